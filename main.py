@@ -1,17 +1,30 @@
 import shutil
 import os
+import json
+import time
+import asyncio
+import threading
+import zipfile
 from datetime import datetime
-from typing import Optional
+from urllib.parse import urlencode
+from typing import Optional, List
 
 # Librerías de FastAPI y Web
-from fastapi import FastAPI, Request, Form, Response, UploadFile, File
+from fastapi import FastAPI, Request, Form, Response, UploadFile, File, BackgroundTasks
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 # Librería de Base de Datos y Errores
 import mysql.connector
-from mysql.connector import IntegrityError
+from mysql.connector import IntegrityError, DataError
+
+# Librería de Imágenes (opcional: sin Pillow los documentos se guardan tal cual)
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 # ==========================================
 # 1. CONFIGURACIÓN GLOBAL DEL SISTEMA
@@ -26,6 +39,31 @@ app.mount("/archivos", StaticFiles(directory="uploads"), name="archivos") # Arch
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")   # Acceso directo a uploads
 templates = Jinja2Templates(directory="templates") # Carpeta de HTMLs
 
+# Procesamiento de documentos del expediente (fotos de actas, CURP, comprobantes)
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+MAX_LADO_DOCUMENTO = 1600   # Pixeles del lado mayor tras reducir la foto
+CALIDAD_JPEG = 75           # Calidad de recompresión
+MAX_LADO_MINIATURA = 240    # Miniaturas para la pestaña de documentos
+GUARDAR_ORIGINALES = False  # True = conserva la foto original en /originales
+
+# Check-in matutino (entrada de alumnos)
+HORA_LIMITE_PUNTUAL = "08:00:00"  # Hasta esta hora es ASISTENCIA
+HORA_LIMITE_RETARDO = "08:20:00"  # Hasta esta hora es RETARDO, después FALTA
+INTERVALO_GUARDADO_ASISTENCIA = 0.3  # Segundos entre cada escritura en lote
+VIGENCIA_TABLERO = 120            # Segundos antes de releer el tablero del día (capturas manuales, otros workers)
+VIGENCIA_PADRON = 600             # Segundos antes de recargar la lista de alumnos
+os.makedirs("bitacoras", exist_ok=True) # Journal local de check-ins pendientes
+BITACORA_CHECKIN = "bitacoras/checkin_pendiente.jsonl"
+
+# Planeaciones
+PERIODOS_LISTA = ["SEP-Q1", "SEP-Q2", "OCT-Q1", "OCT-Q2", "NOV-Q1", "NOV-Q2"]
+ESTADOS_PLANEACION = ["EN_REVISION", "APROBADO"]
+PLANEACIONES_POR_PAGINA = 25
+
+# Bitácora de eventos (auditoría de cambios)
+INTERVALO_GUARDADO_EVENTOS = 1.0  # Segundos entre cada escritura en lote
+MAX_EVENTOS_EN_COLA = 10000       # Si la BD no responde, se descartan los más viejos
+
 # ==========================================
 # 2. CONEXIÓN A BASE DE DATOS (XAMPP)
 # ==========================================
@@ -108,6 +146,7 @@ async def guardar_nuevo_password(request: Request, pass1: str = Form(...), pass2
     conn.commit()
     cursor.close()
     conn.close()
+    registrar_evento(usuario, "PASSWORD", "Cambio de contraseña")
     return RedirectResponse(url="/dashboard", status_code=303)
 
 # ==========================================
@@ -261,6 +300,7 @@ async def subir_archivo(
             """
             cursor.execute(query, (id_maestro, archivo.filename, nombre_seguro, comentarios, CICLO_ACTUAL, periodo))
             conn.commit()
+            registrar_evento(usuario, "PLANEACION", f"Subió planeación {archivo.filename} ({periodo})", id_maestro=id_maestro)
         
         cursor.close()
         conn.close()
@@ -271,7 +311,7 @@ async def subir_archivo(
         return HTMLResponse("Error interno", status_code=500)
 
 @app.get("/maestro/justificar/{id_alumno}")
-async def justificar_alumno(id_alumno: int, fecha: str):
+async def justificar_alumno(request: Request, id_alumno: int, fecha: str):
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -289,6 +329,9 @@ async def justificar_alumno(id_alumno: int, fecha: str):
         """, (id_alumno, fecha))
         
     conn.commit()
+    registrar_evento(request.cookies.get("usuario_logueado"), "ASISTENCIA", f"Justificó la asistencia del {fecha}", id_alumno=id_alumno)
+    if fecha == datetime.now().strftime('%Y-%m-%d'):
+        publicar_asistencia(fecha, consultar_filas_tablero(cursor, fecha, [id_alumno]))
     conn.close()
     return RedirectResponse(url=f"/dashboard?fecha={fecha}", status_code=303)
 
@@ -338,7 +381,7 @@ async def ver_kanban(request: Request, periodo: str = "SEP-Q1"):
     return templates.TemplateResponse("director_kanban.html", {
         "request": request, "periodo_actual": periodo,
         "pendientes": columna_pendientes, "revision": columna_revision, "aprobados": columna_aprobados,
-        "periodos_lista": ["SEP-Q1", "SEP-Q2", "OCT-Q1", "OCT-Q2", "NOV-Q1", "NOV-Q2"] 
+        "periodos_lista": PERIODOS_LISTA
     })
 
 @app.post("/director/aprobar-feedback")
@@ -347,7 +390,11 @@ async def aprobar_con_feedback(request: Request, id_planeacion_modal: int = Form
     cursor = conn.cursor()
     cursor.execute("UPDATE planeaciones SET estado = 'APROBADO', retroalimentacion = %s WHERE id_planeacion = %s", (feedback, id_planeacion_modal))
     conn.commit()
+    cursor.execute("SELECT id_maestro, nombre_archivo FROM planeaciones WHERE id_planeacion = %s", (id_planeacion_modal,))
+    planeacion = cursor.fetchone()
     conn.close()
+    if planeacion:
+        registrar_evento(request.cookies.get("usuario_logueado"), "APROBACION", f"Aprobó planeación {planeacion[1]}: {feedback}", id_maestro=planeacion[0])
     return RedirectResponse(url="/director/kanban", status_code=303)
 
 # ==========================================
@@ -359,16 +406,9 @@ async def ver_asistencias(request: Request):
     usuario = request.cookies.get("usuario_logueado")
     if not usuario: return RedirectResponse(url="/")
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    query = """
-    SELECT a.hora_entrada, a.estado, al.nombre_completo, g.grado, g.grupo
-    FROM asistencia a JOIN alumnos al ON a.id_alumno = al.id_alumno JOIN grupos g ON al.id_grupo = g.id_grupo
-    WHERE a.fecha = CURDATE() ORDER BY a.hora_entrada DESC
-    """
-    cursor.execute(query)
-    resultados = cursor.fetchall()
-    conn.close()
+    # Una recarga completa de la página relee la BD y de paso refresca el tablero en memoria
+    # (ver sección 13); las pantallas abiertas se actualizan por el stream
+    resultados = await obtener_tablero_hoy(max_edad=0)
     return templates.TemplateResponse("asistencia_director.html", {
         "request": request, "lista_asistencia": resultados, "fecha_hoy": datetime.now().strftime('%d/%m/%Y')
     })
@@ -447,12 +487,18 @@ async def guardar_asignacion(request: Request):
     form_data = await request.form()
     conn = get_db_connection()
     cursor = conn.cursor()
+    cambios = []
     try:
         for key, value in form_data.items():
             if key.startswith("grupo_"):
                 id_grupo = key.split("_")[1]
                 cursor.execute("UPDATE grupos SET id_maestro_encargado = %s WHERE id_grupo = %s", (value, id_grupo))
+                if cursor.rowcount: # Solo los grupos que sí cambiaron de maestro
+                    cambios.append((id_grupo, value))
         conn.commit()
+        usuario = request.cookies.get("usuario_logueado")
+        for id_grupo, id_maestro in cambios:
+            registrar_evento(usuario, "ASIGNACION", f"Asignó el grupo {id_grupo}", id_maestro=int(id_maestro) if id_maestro else None)
     finally:
         cursor.close()
         conn.close()
@@ -472,6 +518,7 @@ async def crear_maestro(request: Request, nombre: str = Form(...), usuario: str
         query = "INSERT INTO users (nombre_completo, usuario, password_hash, rol, requiere_cambio) VALUES (%s, %s, %s, 'MAESTRO', 1)"
         cursor.execute(query, (nombre, usuario, password))
         conn.commit()
+        registrar_evento(request.cookies.get("usuario_logueado"), "PERSONAL", f"Registró al maestro {nombre} ({usuario})", id_maestro=cursor.lastrowid)
         mensaje = f"¡Maestro {nombre} registrado correctamente!"
         tipo = "exito"
     except IntegrityError as e:
@@ -511,8 +558,10 @@ async def menu_expedientes(request: Request):
     """
     cursor.execute(query)
     alumnos = cursor.fetchall()
+    cursor.execute("SELECT id_grupo, grado, grupo FROM grupos ORDER BY grado, grupo")
+    grupos = cursor.fetchall()
     conn.close()
-    return templates.TemplateResponse("director_expedientes_menu.html", {"request": request, "alumnos": alumnos})
+    return templates.TemplateResponse("director_expedientes_menu.html", {"request": request, "alumnos": alumnos, "grupos": grupos})
 
 # VISTA AGREGAR ALUMNO
 @app.get("/director/agregar-alumno", response_class=HTMLResponse)
@@ -556,6 +605,8 @@ async def guardar_alumno(
         
         # OBTENEMOS EL ID DEL ALUMNO RECIÉN CREADO
         id_nuevo_alumno = cursor.lastrowid 
+        invalidar_padron()
+        registrar_evento(request.cookies.get("usuario_logueado"), "ALUMNO", f"Inscribió a {nombre}", id_alumno=id_nuevo_alumno)
         
     except Exception as e:
         print(f"Error: {e}")
@@ -599,13 +650,24 @@ async def perfil_alumno(request: Request, id_alumno: int):
     
     cursor.execute("SELECT * FROM documentos_alumnos WHERE id_alumno = %s ORDER BY categoria", (id_alumno,))
     documentos = cursor.fetchall()
+    for doc in documentos:
+        doc['miniatura'] = ruta_miniatura_existente(doc['ruta_archivo'])
     
     cursor.execute("SELECT * FROM historial_tramites WHERE id_alumno = %s ORDER BY fecha DESC", (id_alumno,))
     historial = cursor.fetchall()
+
+    # Usa el índice (id_alumno, fecha) de la bitácora de eventos
+    try:
+        cursor.execute("SELECT * FROM bitacora_eventos WHERE id_alumno = %s ORDER BY fecha DESC LIMIT 50", (id_alumno,))
+        actividad = cursor.fetchall()
+    except Exception as e:
+        print(f"Error leyendo bitácora de eventos: {e}")
+        actividad = []
     conn.close()
 
     return templates.TemplateResponse("director_perfil_alumno.html", {
-        "request": request, "alumno": alumno, "documentos": documentos, "historial": historial, "usuario_logueado": usuario
+        "request": request, "alumno": alumno, "documentos": documentos, "historial": historial,
+        "actividad": actividad, "usuario_logueado": usuario
     })
 
 # ACCIÓN: ACTUALIZAR DATOS COMPLETOS (CON 4 TELÉFONOS)
@@ -638,6 +700,8 @@ async def actualizar_datos_alumno(
         """
         cursor.execute(query, (nombre, curp, contacto, tel_tutor, tel_madre, tel_padre, tel_emergencia, id_alumno))
         conn.commit()
+        invalidar_padron()
+        registrar_evento(request.cookies.get("usuario_logueado"), "ALUMNO", "Actualizó datos generales y teléfonos", id_alumno=id_alumno)
     except Exception as e:
         print(f"Error actualizando: {e}")
     finally:
@@ -646,25 +710,50 @@ async def actualizar_datos_alumno(
     return RedirectResponse(url=f"/director/perfil-alumno/{id_alumno}?msg=Datos actualizados correctamente", status_code=303)
 
 # SUBIR DOCUMENTO A LA BÓVEDA
+# La compresión y las miniaturas se hacen en segundo plano para no frenar la respuesta
 @app.post("/director/subir-documento-alumno")
-async def subir_documento_alumno(request: Request, id_alumno: int = Form(...), categoria: str = Form(...), archivo: UploadFile = File(...)):
+async def subir_documento_alumno(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    id_alumno: int = Form(...),
+    categoria: str = Form(...),
+    archivo: List[UploadFile] = File(...),
+    convertir_pdf: bool = Form(False) # Une todas las fotos en un solo PDF
+):
     try:
         carpeta_alumno = f"uploads/alumnos/{id_alumno}"
         os.makedirs(carpeta_alumno, exist_ok=True)
-        nombre_limpio = f"{categoria}_{archivo.filename.replace(' ', '_')}"
-        ruta_guardado = f"{carpeta_alumno}/{nombre_limpio}"
-        
-        with open(ruta_guardado, "wb") as buffer:
-            shutil.copyfileobj(archivo.file, buffer)
+
+        rutas_guardadas = []
+        for subido in archivo:
+            # Los celulares suelen mandar todas las fotos como "image.jpg": cada una recibe nombre propio
+            nombre_limpio = f"{categoria}_{subido.filename.replace(' ', '_')}"
+            buffer, ruta_guardado = crear_archivo_libre(f"{carpeta_alumno}/{nombre_limpio}")
+            with buffer:
+                shutil.copyfileobj(subido.file, buffer)
+            rutas_guardadas.append((subido.filename, ruta_guardado))
 
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO documentos_alumnos (id_alumno, categoria, nombre_archivo, ruta_archivo, estado) VALUES (%s, %s, %s, %s, 'PENDIENTE')", (id_alumno, categoria, archivo.filename, ruta_guardado))
+
+        todas_imagenes = all(es_imagen(ruta) for _, ruta in rutas_guardadas)
+        if convertir_pdf and Image is not None and rutas_guardadas and todas_imagenes:
+            # Un solo registro; apunta a la primera foto hasta que el PDF esté listo
+            ruta_pdf = ruta_libre(f"{carpeta_alumno}/{categoria}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf")
+            cursor.execute(SQL_INSERTAR_DOCUMENTO, (id_alumno, categoria, os.path.basename(ruta_pdf), rutas_guardadas[0][1]))
+            background_tasks.add_task(unir_imagenes_pdf, id_alumno, categoria, rutas_guardadas, ruta_pdf)
+        else:
+            for nombre_original, ruta in rutas_guardadas:
+                cursor.execute(SQL_INSERTAR_DOCUMENTO, (id_alumno, categoria, nombre_original, ruta))
+                if es_imagen(ruta):
+                    background_tasks.add_task(optimizar_imagen_documento, id_alumno, ruta)
         conn.commit()
         conn.close()
+        nombres = ", ".join(nombre for nombre, _ in rutas_guardadas)
+        registrar_evento(request.cookies.get("usuario_logueado"), "DOCUMENTO", f"Subió {categoria}: {nombres}", id_alumno=id_alumno)
     except Exception as e:
         print(f"Error subiendo: {e}")
-    return RedirectResponse(url=f"/director/perfil-alumno/{id_alumno}", status_code=303)
+    return RedirectResponse(url=f"/director/perfil-alumno/{id_alumno}?tab=documentos", status_code=303)
 
 # GENERADOR DE DOCUMENTOS (PDF)
 @app.post("/director/imprimir-documento-avanzado")
@@ -681,11 +770,12 @@ async def imprimir_avanzado(
     cursor.execute("SELECT a.nombre_completo, a.curp, g.grado, g.grupo FROM alumnos a JOIN grupos g ON a.id_grupo = g.id_grupo WHERE a.id_alumno = %s", (id_alumno,))
     alumno = cursor.fetchone()
     
-    # Registrar en historial
+    # Registrar en historial (directo, para no perder la emisión si el servidor se reinicia)
     usuario = request.cookies.get("usuario_logueado")
     cursor.execute("INSERT INTO historial_tramites (id_alumno, tramite, usuario_responsable) VALUES (%s, %s, %s)", (id_alumno, f"Generación de {tipo_documento}", usuario))
     conn.commit()
     conn.close()
+    registrar_evento(usuario, "TRAMITE", f"Generación de {tipo_documento}", id_alumno=id_alumno)
 
     # Fecha bonita
     meses = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
@@ -699,6 +789,182 @@ async def imprimir_avanzado(
         "n1": nota1, "n2": nota2, "n3": nota3, "pf": promedio_final
     })
 # ==========================================
+# 10. PROCESAMIENTO DE DOCUMENTOS (COMPRESIÓN Y MINIATURAS)
+# ==========================================
+# Estas funciones corren como BackgroundTasks (fuera de la petición).
+# Si Pillow no está instalado, los archivos se quedan como se subieron.
+
+def es_imagen(ruta: str):
+    return ruta.lower().endswith(EXTENSIONES_IMAGEN)
+
+# HELPER: Ruta de la miniatura que le corresponde a un documento
+# Se conserva la extensión (acta.png -> acta.png.jpg) para que acta.png y acta.jpg no choquen
+def ruta_miniatura(ruta_archivo: str):
+    carpeta, nombre = os.path.split(ruta_archivo)
+    return f"{carpeta}/miniaturas/{nombre}.jpg"
+
+SQL_INSERTAR_DOCUMENTO = "INSERT INTO documentos_alumnos (id_alumno, categoria, nombre_archivo, ruta_archivo, estado) VALUES (%s, %s, %s, %s, 'PENDIENTE')"
+
+# HELPER: Primera ruta que no exista: acta.jpg, acta_1.jpg, acta_2.jpg...
+def ruta_libre(ruta: str):
+    base, extension = os.path.splitext(ruta)
+    candidata = ruta
+    contador = 1
+    while os.path.exists(candidata):
+        candidata = f"{base}_{contador}{extension}"
+        contador += 1
+    return candidata
+
+# HELPER: Crea (en modo exclusivo) un archivo con nombre libre; regresa (archivo, ruta).
+# El modo "xb" evita que dos subidas simultáneas se queden con el mismo nombre.
+def crear_archivo_libre(ruta: str):
+    while True:
+        candidata = ruta_libre(ruta)
+        try:
+            return open(candidata, "xb"), candidata
+        except FileExistsError:
+            continue
+
+# HELPER: Ruta .jpg para la versión comprimida que no pise otro documento del alumno
+def ruta_jpg_libre(ruta: str):
+    if ruta.lower().endswith((".jpg", ".jpeg")):
+        return ruta # Se reemplaza a sí misma
+    return ruta_libre(os.path.splitext(ruta)[0] + ".jpg")
+
+# HELPER: Solo regresa la miniatura si ya fue generada (si no, el HTML muestra un ícono)
+def ruta_miniatura_existente(ruta_archivo: str):
+    ruta = ruta_miniatura(ruta_archivo)
+    return ruta if os.path.exists(ruta) else None
+
+def abrir_imagen_corregida(ruta: str):
+    # Las fotos de celular traen la rotación en EXIF; la aplicamos antes de reducir
+    imagen = ImageOps.exif_transpose(Image.open(ruta))
+    if imagen.mode != "RGB":
+        imagen = imagen.convert("RGB")
+    return imagen
+
+def generar_miniatura(imagen, ruta_archivo: str):
+    destino = ruta_miniatura(ruta_archivo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    mini = imagen.copy()
+    mini.thumbnail((MAX_LADO_MINIATURA, MAX_LADO_MINIATURA))
+    mini.save(destino, "JPEG", quality=60, optimize=True)
+
+def ruta_respaldo_original(ruta: str):
+    carpeta, nombre = os.path.split(ruta)
+    os.makedirs(f"{carpeta}/originales", exist_ok=True)
+    return ruta_libre(f"{carpeta}/originales/{nombre}")
+
+# HELPER: Mueve el original a /originales o lo borra, según GUARDAR_ORIGINALES.
+# Solo se llama cuando el registro ya apunta al archivo nuevo.
+def retirar_original(ruta: str):
+    if GUARDAR_ORIGINALES:
+        shutil.move(ruta, ruta_respaldo_original(ruta))
+    elif os.path.exists(ruta):
+        os.remove(ruta)
+
+# HELPER: Deja constancia en la actividad del alumno de cuánto espacio se ahorró
+# (no es un trámite, así que no aparece en la Bitácora de Emisiones)
+def registrar_ahorro(id_alumno: int, descripcion: str, bytes_antes: int, bytes_despues: int):
+    kb_antes = bytes_antes // 1024
+    kb_despues = bytes_despues // 1024
+    registrar_evento("SISTEMA", "OPTIMIZACION", f"{descripcion}: {kb_antes} KB → {kb_despues} KB", id_alumno=id_alumno)
+
+# TAREA: Reducir y recomprimir una foto, y generar su miniatura
+def optimizar_imagen_documento(id_alumno: int, ruta: str):
+    if Image is None: return
+    try:
+        bytes_antes = os.path.getsize(ruta)
+        imagen = abrir_imagen_corregida(ruta)
+        imagen.thumbnail((MAX_LADO_DOCUMENTO, MAX_LADO_DOCUMENTO))
+
+        # Guardamos a un temporal y solo reemplazamos si de verdad pesa menos
+        ruta_final = ruta_jpg_libre(ruta)
+        temporal = ruta_final + ".tmp"
+        imagen.save(temporal, "JPEG", quality=CALIDAD_JPEG, optimize=True, progressive=True)
+        bytes_despues = os.path.getsize(temporal)
+        if bytes_despues >= bytes_antes:
+            os.remove(temporal)
+            generar_miniatura(imagen, ruta)
+            return
+
+        if ruta_final == ruta:
+            # Mismo nombre: el registro no cambia y os.replace es atómico
+            if GUARDAR_ORIGINALES:
+                shutil.copy2(ruta, ruta_respaldo_original(ruta))
+            os.replace(temporal, ruta_final)
+        else:
+            # Orden seguro: archivo nuevo -> registro apuntando a él -> quitar el original
+            os.replace(temporal, ruta_final)
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                cursor.execute("UPDATE documentos_alumnos SET ruta_archivo = %s WHERE id_alumno = %s AND ruta_archivo = %s", (ruta_final, id_alumno, ruta))
+                conn.commit()
+                conn.close()
+            except Exception:
+                os.remove(ruta_final) # El registro sigue apuntando al original, que no se tocó
+                raise
+            retirar_original(ruta)
+        generar_miniatura(imagen, ruta_final)
+
+        registrar_ahorro(id_alumno, os.path.basename(ruta), bytes_antes, bytes_despues)
+    except Exception as e:
+        print(f"Error optimizando imagen: {e}")
+
+# HELPER: Si no se pudo armar el PDF, cada foto queda como documento propio
+def registrar_paginas_sueltas(id_alumno: int, categoria: str, paginas):
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # El registro que ya existe apunta a la primera foto; solo corregimos su nombre
+        nombre_primera, ruta_primera = paginas[0]
+        cursor.execute("UPDATE documentos_alumnos SET nombre_archivo = %s WHERE id_alumno = %s AND ruta_archivo = %s", (nombre_primera, id_alumno, ruta_primera))
+        for nombre_original, ruta in paginas[1:]:
+            cursor.execute(SQL_INSERTAR_DOCUMENTO, (id_alumno, categoria, nombre_original, ruta))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error registrando páginas sueltas: {e}")
+
+# TAREA: Unir varias fotos (ej. las hojas de un acta) en un solo PDF
+# `paginas_subidas` es la lista de (nombre original, ruta) tal como se subieron
+def unir_imagenes_pdf(id_alumno: int, categoria: str, paginas_subidas, ruta_pdf: str):
+    rutas = [ruta for _, ruta in paginas_subidas]
+    try:
+        bytes_antes = sum(os.path.getsize(r) for r in rutas)
+        paginas = []
+        for ruta in rutas:
+            imagen = abrir_imagen_corregida(ruta)
+            imagen.thumbnail((MAX_LADO_DOCUMENTO, MAX_LADO_DOCUMENTO))
+            paginas.append(imagen)
+
+        generar_miniatura(paginas[0], ruta_pdf)
+        paginas[0].save(ruta_pdf, "PDF", save_all=True, append_images=paginas[1:], resolution=150, quality=CALIDAD_JPEG)
+        bytes_despues = os.path.getsize(ruta_pdf)
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE documentos_alumnos SET ruta_archivo = %s WHERE id_alumno = %s AND ruta_archivo = %s", (ruta_pdf, id_alumno, rutas[0]))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error uniendo PDF: {e}")
+        if os.path.exists(ruta_pdf):
+            os.remove(ruta_pdf)
+        registrar_paginas_sueltas(id_alumno, categoria, paginas_subidas)
+        return
+
+    # El registro ya apunta al PDF; las fotos sueltas ya no se necesitan
+    for ruta in rutas:
+        try:
+            retirar_original(ruta)
+        except Exception as e:
+            print(f"Error retirando original: {e}")
+
+    registrar_ahorro(id_alumno, os.path.basename(ruta_pdf), bytes_antes, bytes_despues)
+
+# ==========================================
 # 11. MÓDULO DE GESTIÓN DE CICLOS (SISTEMA)
 # ==========================================
 
@@ -748,6 +1014,7 @@ async def crear_ciclo(request: Request, nombre_ciclo: str = Form(...)):
         query = "INSERT INTO ciclos (nombre, activo) VALUES (%s, 0)"
         cursor.execute(query, (nombre_ciclo,))
         conn.commit()
+        registrar_evento(request.cookies.get("usuario_logueado"), "CICLO", f"Creó el ciclo {nombre_ciclo}")
     except Exception as e:
         print(f"Error creando ciclo: {e}")
         # Aquí podrías manejar el error si intentan crear un duplicado
@@ -758,7 +1025,7 @@ async def crear_ciclo(request: Request, nombre_ciclo: str = Form(...)):
 
 # ACCIÓN: ACTIVAR UN CICLO (CAMBIO DE AÑO)
 @app.get("/director/activar-ciclo/{id_ciclo}")
-async def activar_ciclo(id_ciclo: int):
+async def activar_ciclo(request: Request, id_ciclo: int):
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -770,9 +1037,701 @@ async def activar_ciclo(id_ciclo: int):
         cursor.execute("UPDATE ciclos SET activo = 1 WHERE id_ciclo = %s", (id_ciclo,))
         
         conn.commit()
+        registrar_evento(request.cookies.get("usuario_logueado"), "CICLO", f"Activó el ciclo {id_ciclo}")
     except Exception as e:
         print(f"Error activando ciclo: {e}")
     finally:
         conn.close()
         
     return RedirectResponse(url="/director/configuracion-ciclos", status_code=303)
+
+# ==========================================
+# 12. CHECK-IN MATUTINO (ENTRADA DE ALUMNOS)
+# ==========================================
+# En la mañana llegan ~300 alumnos en 15 minutos. El check-in responde al
+# instante: busca al alumno en memoria, lo anota en un journal local y en un
+# buffer, y una tarea de fondo guarda el buffer en `asistencia` por lotes.
+
+padron_alumnos = {"por_id": {}, "por_curp": {}, "cargado": 0.0}
+buffer_asistencia = {}   # (id_alumno, fecha) -> registro pendiente de guardar
+registrados_hoy = {"fecha": None, "ids": set()}  # Alumnos que ya hicieron check-in hoy
+candado_asistencia = threading.Lock()
+candado_padron = asyncio.Lock()
+
+# HELPER: Cargar la lista de alumnos a memoria (CURP e id -> datos básicos)
+def cargar_padron():
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT id_alumno, curp, nombre_completo, id_grupo FROM alumnos")
+    alumnos = cursor.fetchall()
+    conn.close()
+    padron_alumnos["por_id"] = {a['id_alumno']: a for a in alumnos}
+    # Alumnos sin CURP solo se encuentran por id (si no, todos compartirían la llave "")
+    padron_alumnos["por_curp"] = {a['curp'].strip().upper(): a for a in alumnos if a['curp'] and a['curp'].strip()}
+    padron_alumnos["cargado"] = time.monotonic()
+
+# HELPER: Forzar recarga del padrón (alta o edición de alumnos)
+def invalidar_padron():
+    padron_alumnos["cargado"] = 0.0
+
+# HELPER: Recarga el padrón en un hilo si tiene más de `max_edad` segundos.
+# El candado evita que varias peticiones lo recarguen al mismo tiempo.
+async def refrescar_padron(max_edad: float):
+    if time.monotonic() - padron_alumnos["cargado"] <= max_edad: return
+    async with candado_padron:
+        if time.monotonic() - padron_alumnos["cargado"] <= max_edad: return # Otra petición ya lo recargó
+        await run_in_threadpool(cargar_padron)
+
+def buscar_en_padron(clave: str):
+    clave = clave.strip().upper()
+    if not clave: return None
+    if clave.isdigit():
+        return padron_alumnos["por_id"].get(int(clave))
+    return padron_alumnos["por_curp"].get(clave)
+
+# HELPER: Clasificar la hora de llegada contra los horarios límite
+def clasificar_entrada(hora: str):
+    if hora <= HORA_LIMITE_PUNTUAL: return "ASISTENCIA"
+    if hora <= HORA_LIMITE_RETARDO: return "RETARDO"
+    return "FALTA"
+
+def escribir_bitacora(ruta: str, registros):
+    with open(ruta, "a", encoding="utf-8") as bitacora:
+        for registro in registros:
+            bitacora.write(json.dumps(registro) + "\n")
+        bitacora.flush()
+        os.fsync(bitacora.fileno())
+
+# HELPER: Al arrancar, recuperar check-ins que no alcanzaron a guardarse
+def recuperar_bitacora():
+    for ruta in (BITACORA_CHECKIN + ".enviando", BITACORA_CHECKIN):
+        if not os.path.exists(ruta): continue
+        with open(ruta, encoding="utf-8") as bitacora:
+            for linea in bitacora:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue # Línea cortada por un apagón a mitad de escritura
+                buffer_asistencia.setdefault((registro['id_alumno'], registro['fecha']), registro)
+                if registro['fecha'] == datetime.now().strftime('%Y-%m-%d'):
+                    registrados_hoy["fecha"] = registro['fecha']
+                    registrados_hoy["ids"].add(registro['id_alumno'])
+    if os.path.exists(BITACORA_CHECKIN + ".enviando"):
+        escribir_bitacora(BITACORA_CHECKIN, buffer_asistencia.values())
+        os.remove(BITACORA_CHECKIN + ".enviando")
+
+# TAREA: Guardar en `asistencia` todo lo acumulado en el buffer (un solo lote)
+def vaciar_buffer_asistencia():
+    with candado_asistencia:
+        if not buffer_asistencia: return
+        # El journal puede no existir todavía si el check-in aún no termina de escribirlo
+        if os.path.exists(BITACORA_CHECKIN):
+            os.replace(BITACORA_CHECKIN, BITACORA_CHECKIN + ".enviando")
+        lote = list(buffer_asistencia.values())
+        buffer_asistencia.clear()
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        for fecha in {r['fecha'] for r in lote}:
+            del_dia = [r for r in lote if r['fecha'] == fecha]
+            ids = [r['id_alumno'] for r in del_dia]
+
+            # Upsert: actualiza los que ya tienen registro ese día, inserta el resto
+            marcas = ", ".join(["%s"] * len(ids))
+            cursor.execute(f"SELECT id_alumno, id_asistencia FROM asistencia WHERE fecha = %s AND id_alumno IN ({marcas})", (fecha, *ids))
+            existentes = dict(cursor.fetchall())
+
+            # Un JUSTIFICADO puesto por el maestro no se pisa, y se respeta la primera entrada
+            cursor.executemany(
+                """UPDATE asistencia SET hora_entrada = %s, estado = %s
+                   WHERE id_asistencia = %s AND estado <> 'JUSTIFICADO'
+                   AND (hora_entrada IS NULL OR hora_entrada = '00:00:00' OR hora_entrada > %s)""",
+                [(r['hora_entrada'], r['estado'], existentes[r['id_alumno']], r['hora_entrada']) for r in del_dia if r['id_alumno'] in existentes])
+            cursor.executemany(
+                "INSERT INTO asistencia (id_alumno, fecha, hora_entrada, estado) VALUES (%s, %s, %s, %s)",
+                [(r['id_alumno'], r['fecha'], r['hora_entrada'], r['estado']) for r in del_dia if r['id_alumno'] not in existentes])
+        conn.commit()
+
+        # Avisamos al tablero en vivo con lo que quedó realmente guardado
+        hoy = datetime.now().strftime('%Y-%m-%d')
+        ids_hoy = [r['id_alumno'] for r in lote if r['fecha'] == hoy]
+        if ids_hoy:
+            publicar_asistencia(hoy, consultar_filas_tablero(cursor, hoy, ids_hoy))
+        conn.close()
+        if os.path.exists(BITACORA_CHECKIN + ".enviando"):
+            os.remove(BITACORA_CHECKIN + ".enviando")
+    except Exception as e:
+        print(f"Error guardando lote de asistencia: {e}")
+        # Regresamos el lote al buffer; el siguiente ciclo lo reintenta
+        with candado_asistencia:
+            for registro in lote:
+                buffer_asistencia.setdefault((registro['id_alumno'], registro['fecha']), registro)
+        # Ya estamos en un hilo de trabajo; el fsync no detiene el event loop ni el candado
+        escribir_bitacora(BITACORA_CHECKIN, lote)
+        if os.path.exists(BITACORA_CHECKIN + ".enviando"):
+            os.remove(BITACORA_CHECKIN + ".enviando")
+
+# HELPER: Ejecuta una tarea de guardado cada cierto intervalo, fuera del event loop
+async def ciclo_periodico(tarea, intervalo: float):
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            await run_in_threadpool(tarea)
+        except Exception as e:
+            print(f"Error en {tarea.__name__}: {e}")
+
+@app.on_event("startup")
+async def iniciar_checkin():
+    recuperar_bitacora()
+    asyncio.create_task(ciclo_periodico(vaciar_buffer_asistencia, INTERVALO_GUARDADO_ASISTENCIA))
+
+@app.on_event("shutdown")
+async def detener_checkin():
+    await run_in_threadpool(vaciar_buffer_asistencia)
+
+# API CHECK-IN (JSON): clave = CURP o id_alumno
+@app.post("/api/checkin")
+async def checkin_alumno(request: Request, clave: str = Form(...)):
+    usuario = request.cookies.get("usuario_logueado")
+    if not usuario: return JSONResponse({"ok": False, "error": "Sesión requerida"}, status_code=401)
+    if not clave.strip():
+        return JSONResponse({"ok": False, "error": "Clave vacía"}, status_code=422)
+
+    await refrescar_padron(VIGENCIA_PADRON)
+    alumno = buscar_en_padron(clave)
+    if not alumno:
+        # Puede ser un alumno recién dado de alta: recargamos (máximo cada 30 s)
+        await refrescar_padron(30)
+        alumno = buscar_en_padron(clave)
+    if not alumno:
+        return JSONResponse({"ok": False, "error": "Alumno no encontrado"}, status_code=404)
+
+    ahora = datetime.now()
+    fecha = ahora.strftime('%Y-%m-%d')
+    hora = ahora.strftime('%H:%M:%S')
+
+    # Bajo el candado solo se toca memoria; el disco se escribe fuera de él
+    with candado_asistencia:
+        if registrados_hoy["fecha"] != fecha:
+            registrados_hoy["fecha"] = fecha
+            registrados_hoy["ids"] = set()
+        if alumno['id_alumno'] in registrados_hoy["ids"]:
+            return {"ok": True, "repetido": True, "alumno": alumno['nombre_completo']}
+        registro = {"id_alumno": alumno['id_alumno'], "fecha": fecha, "hora_entrada": hora, "estado": clasificar_entrada(hora)}
+        buffer_asistencia[(alumno['id_alumno'], fecha)] = registro
+        registrados_hoy["ids"].add(alumno['id_alumno'])
+
+    # El journal (con fsync) va en un hilo para no frenar al resto de peticiones.
+    # Si el lote ya se guardó antes de esta línea, repetirla al recuperar no hace daño.
+    try:
+        await run_in_threadpool(escribir_bitacora, BITACORA_CHECKIN, [registro])
+    except Exception as e:
+        print(f"Error escribiendo journal de check-in: {e}")
+
+    return {"ok": True, "repetido": False, "alumno": alumno['nombre_completo'], "estado": registro['estado'], "hora": hora}
+
+# ==========================================
+# 13. TABLERO EN VIVO DE ASISTENCIA (SSE)
+# ==========================================
+# El tablero del día se guarda en memoria. Cada cambio (justificación o
+# check-in) actualiza esa copia y se reparte a todas las pantallas
+# conectadas. Cada VIGENCIA_TABLERO segundos se relee de la BD (una sola
+# consulta, sin importar cuántas pantallas haya) para incluir capturas que
+# no pasaron por aquí, y se manda la foto completa a las pantallas.
+
+# filas: id_alumno -> fila. pendientes: cambios que llegan mientras se carga de la BD
+tablero_hoy = {"fecha": None, "filas": {}, "pendientes": None, "cargado": 0.0}
+FOTO_COMPLETA = object()  # Aviso en la cola: mandar el tablero completo
+suscriptores_tablero = set()                 # Una cola por pantalla conectada
+candado_tablero = asyncio.Lock()
+bucle_eventos = {"loop": None}
+
+async def ciclo_resincronizar_tablero():
+    while True:
+        await asyncio.sleep(VIGENCIA_TABLERO)
+        if not suscriptores_tablero: continue # Sin pantallas abiertas no hace falta releer
+        try:
+            await obtener_tablero_hoy()
+        except Exception as e:
+            print(f"Error resincronizando tablero: {e}")
+            continue
+        hoy = datetime.now().strftime('%Y-%m-%d')
+        for cola in list(suscriptores_tablero):
+            try:
+                cola.put_nowait((hoy, FOTO_COMPLETA))
+            except asyncio.QueueFull:
+                suscriptores_tablero.discard(cola)
+
+@app.on_event("startup")
+async def iniciar_tablero():
+    bucle_eventos["loop"] = asyncio.get_running_loop()
+    asyncio.create_task(ciclo_resincronizar_tablero())
+
+def formatear_hora(hora):
+    # MySQL regresa TIME como timedelta
+    if hasattr(hora, "total_seconds"):
+        segundos = int(hora.total_seconds())
+        return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+    return str(hora) if hora is not None else ""
+
+# HELPER: Filas del tablero de un día (opcionalmente solo ciertos alumnos)
+def consultar_filas_tablero(cursor, fecha: str, ids_alumnos: Optional[List[int]] = None):
+    query = """
+    SELECT a.id_alumno, a.hora_entrada, a.estado, al.nombre_completo, g.grado, g.grupo
+    FROM asistencia a JOIN alumnos al ON a.id_alumno = al.id_alumno JOIN grupos g ON al.id_grupo = g.id_grupo
+    WHERE a.fecha = %s
+    """
+    parametros = [fecha]
+    if ids_alumnos is not None:
+        query += " AND a.id_alumno IN (" + ", ".join(["%s"] * len(ids_alumnos)) + ")"
+        parametros += ids_alumnos
+    # El cursor puede venir sin dictionary=True; armamos los diccionarios a mano
+    cursor.execute(query, parametros)
+    columnas = [c[0] for c in cursor.description]
+    filas = [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+    for fila in filas:
+        fila['hora_entrada'] = formatear_hora(fila['hora_entrada'])
+    return filas
+
+def cargar_tablero(fecha: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    filas = consultar_filas_tablero(cursor, fecha)
+    conn.close()
+    return filas
+
+def ordenar_tablero():
+    return sorted(tablero_hoy["filas"].values(), key=lambda f: f['hora_entrada'], reverse=True)
+
+# HELPER: Tablero de hoy desde memoria (lo relee de la BD si cambió el día
+# o si la copia tiene más de `max_edad` segundos)
+async def obtener_tablero_hoy(max_edad: float = VIGENCIA_TABLERO):
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    async with candado_tablero:
+        if tablero_hoy["fecha"] != hoy or time.monotonic() - tablero_hoy["cargado"] > max_edad:
+            # Marcamos la fecha ANTES de consultar: lo que se publique durante la
+            # carga se junta en "pendientes" y se aplica encima del resultado
+            if tablero_hoy["fecha"] != hoy:
+                tablero_hoy["filas"] = {}
+            tablero_hoy["fecha"] = hoy
+            tablero_hoy["pendientes"] = []
+            try:
+                filas = await run_in_threadpool(cargar_tablero, hoy)
+            except Exception:
+                tablero_hoy["fecha"] = None
+                raise
+            finally:
+                pendientes = tablero_hoy["pendientes"]
+                tablero_hoy["pendientes"] = None
+            tablero_hoy["filas"] = {f['id_alumno']: f for f in filas}
+            for fila in pendientes:
+                tablero_hoy["filas"][fila['id_alumno']] = fila
+            tablero_hoy["cargado"] = time.monotonic()
+    return ordenar_tablero()
+
+def difundir_asistencia(fecha: str, filas):
+    if tablero_hoy["fecha"] == fecha:
+        for fila in filas:
+            tablero_hoy["filas"][fila['id_alumno']] = fila
+        if tablero_hoy["pendientes"] is not None:
+            tablero_hoy["pendientes"].extend(filas)
+    for cola in list(suscriptores_tablero):
+        try:
+            cola.put_nowait((fecha, filas))
+        except asyncio.QueueFull:
+            # Pantalla demasiado lenta: la desconectamos y al reconectar recibe la foto completa
+            suscriptores_tablero.discard(cola)
+
+# Se puede llamar desde rutas o desde el hilo que guarda los check-ins
+def publicar_asistencia(fecha: str, filas):
+    loop = bucle_eventos["loop"]
+    if loop is None or not filas: return
+    loop.call_soon_threadsafe(difundir_asistencia, fecha, filas)
+
+def evento_sse(nombre: str, datos):
+    return f"event: {nombre}\ndata: {json.dumps(datos, default=str)}\n\n"
+
+# STREAM SSE: foto inicial una vez, después solo las filas nuevas o modificadas
+@app.get("/ver-asistencias/stream")
+async def stream_asistencias(request: Request):
+    usuario = request.cookies.get("usuario_logueado")
+    if not usuario: return RedirectResponse(url="/")
+
+    async def generador():
+        cola = asyncio.Queue(maxsize=200)
+        suscriptores_tablero.add(cola)
+        async def foto_completa():
+            filas = await obtener_tablero_hoy()
+            return evento_sse("snapshot", {"fecha": datetime.now().strftime('%d/%m/%Y'), "filas": filas})
+
+        try:
+            fecha_pantalla = datetime.now().strftime('%Y-%m-%d')
+            yield await foto_completa()
+            while cola in suscriptores_tablero:
+                if await request.is_disconnected(): break
+                try:
+                    fecha, filas = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    fecha, filas = None, None
+
+                # Pasó la medianoche: la pantalla recibe el tablero del nuevo día
+                hoy = datetime.now().strftime('%Y-%m-%d')
+                if hoy != fecha_pantalla:
+                    fecha_pantalla = hoy
+                    yield await foto_completa()
+                elif filas is FOTO_COMPLETA:
+                    yield await foto_completa() # Resincronización periódica con la BD
+                elif filas and fecha == fecha_pantalla:
+                    yield evento_sse("asistencia", filas)
+                elif filas is None:
+                    yield ": ping\n\n" # Mantiene viva la conexión
+        finally:
+            suscriptores_tablero.discard(cola)
+
+    return StreamingResponse(generador(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ==========================================
+# 14. DESCARGA DE EXPEDIENTES (ZIP EN STREAMING)
+# ==========================================
+# El ZIP se arma al vuelo: cada archivo se lee en pedazos y los bytes
+# comprimidos se mandan al navegador conforme salen. No hay archivos
+# temporales ni se carga un documento completo en memoria.
+
+TAMANO_PEDAZO_ZIP = 64 * 1024
+
+# HELPER: "Archivo" de solo escritura que junta lo que zipfile va produciendo
+class FlujoZip:
+    def __init__(self):
+        self.pedazos = []
+
+    def write(self, datos):
+        self.pedazos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self.pedazos)
+        self.pedazos = []
+        return datos
+
+def nombre_carpeta_alumno(alumno):
+    nombre = "".join(c if c.isalnum() else "_" for c in alumno['nombre_completo'])
+    return f"{nombre}_{alumno['id_alumno']}"
+
+# HELPER: Resumen en texto del alumno y su bitácora de trámites
+def resumen_expediente(alumno, historial):
+    lineas = [
+        f"EXPEDIENTE: {alumno['nombre_completo']}",
+        f"CURP: {alumno['curp']}",
+        f"Grupo: {alumno['grado']}° \"{alumno['grupo']}\"",
+        f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        "",
+        "HISTORIAL DE TRÁMITES",
+        "---------------------",
+    ]
+    for log in historial:
+        lineas.append(f"{log['fecha']}  |  {log['tramite']}  |  {log['usuario_responsable']}")
+    if not historial:
+        lineas.append("Sin trámites registrados.")
+    return "\n".join(lineas) + "\n"
+
+def consultar_expedientes(where: str, parametro):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""
+        SELECT a.id_alumno, a.nombre_completo, a.curp, g.grado, g.grupo
+        FROM alumnos a JOIN grupos g ON a.id_grupo = g.id_grupo
+        WHERE {where} ORDER BY a.nombre_completo
+    """, (parametro,))
+    alumnos = cursor.fetchall()
+    for alumno in alumnos:
+        cursor.execute("SELECT * FROM historial_tramites WHERE id_alumno = %s ORDER BY fecha DESC", (alumno['id_alumno'],))
+        alumno['historial'] = cursor.fetchall()
+    conn.close()
+    return alumnos
+
+# GENERADOR: Produce el ZIP pedazo a pedazo (StreamingResponse lo corre en un hilo)
+def generar_zip_expedientes(alumnos, con_carpetas: bool):
+    flujo = FlujoZip()
+    with zipfile.ZipFile(flujo, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archivo_zip:
+        for alumno in alumnos:
+            prefijo = nombre_carpeta_alumno(alumno) + "/" if con_carpetas else ""
+            archivo_zip.writestr(prefijo + "resumen_expediente.txt", resumen_expediente(alumno, alumno['historial']))
+            yield flujo.vaciar()
+
+            carpeta_alumno = f"uploads/alumnos/{alumno['id_alumno']}"
+            for raiz, carpetas, archivos in os.walk(carpeta_alumno):
+                carpetas[:] = [c for c in carpetas if c != "miniaturas"] # Se regeneran, no son del expediente
+                for nombre in sorted(archivos):
+                    ruta = os.path.join(raiz, nombre)
+                    destino = prefijo + os.path.relpath(ruta, carpeta_alumno).replace(os.sep, "/")
+                    with open(ruta, "rb") as origen, archivo_zip.open(destino, "w") as salida:
+                        while True:
+                            pedazo = origen.read(TAMANO_PEDAZO_ZIP)
+                            if not pedazo: break
+                            salida.write(pedazo)
+                            yield flujo.vaciar()
+    yield flujo.vaciar() # Directorio central del ZIP
+
+def respuesta_zip(alumnos, nombre_zip: str, con_carpetas: bool):
+    return StreamingResponse(
+        generar_zip_expedientes(alumnos, con_carpetas),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_zip}"'}
+    )
+
+# DESCARGA: Expediente completo de un alumno
+@app.get("/director/expediente-zip/{id_alumno}")
+async def descargar_expediente(request: Request, id_alumno: int):
+    usuario = request.cookies.get("usuario_logueado")
+    if not usuario: return RedirectResponse(url="/")
+
+    alumnos = consultar_expedientes("a.id_alumno = %s", id_alumno)
+    if not alumnos: return HTMLResponse("Alumno no encontrado", status_code=404)
+    return respuesta_zip(alumnos, f"expediente_{nombre_carpeta_alumno(alumnos[0])}.zip", con_carpetas=False)
+
+# DESCARGA: Expedientes de todo un grupo en un solo ZIP (una carpeta por alumno)
+@app.get("/director/expedientes-grupo-zip/{id_grupo}")
+async def descargar_expedientes_grupo(request: Request, id_grupo: int):
+    usuario = request.cookies.get("usuario_logueado")
+    if not usuario: return RedirectResponse(url="/")
+
+    alumnos = consultar_expedientes("a.id_grupo = %s", id_grupo)
+    if not alumnos: return HTMLResponse("El grupo no tiene alumnos", status_code=404)
+    return respuesta_zip(alumnos, f"expedientes_{alumnos[0]['grado']}{alumnos[0]['grupo']}.zip", con_carpetas=True)
+
+# ==========================================
+# 15. BITÁCORA DE EVENTOS (AUDITORÍA)
+# ==========================================
+# Cada ruta que modifica datos llama a registrar_evento(), que solo agrega
+# el evento a una cola en memoria. Una tarea de fondo guarda la cola por
+# lotes en `bitacora_eventos`. `historial_tramites` (la "Bitácora de
+# Emisiones") se sigue escribiendo directo desde imprimir_avanzado.
+
+cola_eventos = []
+candado_eventos = threading.Lock()
+
+# Índices por alumno, maestro y fecha para las consultas de historial
+SQL_TABLA_EVENTOS = """
+CREATE TABLE IF NOT EXISTS bitacora_eventos (
+    id_evento INT AUTO_INCREMENT PRIMARY KEY,
+    fecha DATETIME NOT NULL,
+    usuario VARCHAR(100),
+    tipo VARCHAR(30) NOT NULL,
+    descripcion TEXT,
+    id_alumno INT NULL,
+    id_maestro INT NULL,
+    INDEX idx_eventos_alumno (id_alumno, fecha),
+    INDEX idx_eventos_maestro (id_maestro, fecha),
+    INDEX idx_eventos_fecha (fecha)
+)
+"""
+
+SQL_INSERTAR_EVENTO = "INSERT INTO bitacora_eventos (fecha, usuario, tipo, descripcion, id_alumno, id_maestro) VALUES (%s, %s, %s, %s, %s, %s)"
+
+# HELPER: Recorta la cola a MAX_EVENTOS_EN_COLA (llamar con el candado tomado)
+def recortar_cola_eventos():
+    sobrantes = len(cola_eventos) - MAX_EVENTOS_EN_COLA
+    if sobrantes > 0:
+        del cola_eventos[:sobrantes]
+        print(f"Error: cola de eventos llena, se descartaron {sobrantes} eventos")
+
+# Se puede llamar desde rutas o desde tareas de fondo; nunca toca la BD
+def registrar_evento(usuario, tipo: str, descripcion: str, id_alumno: Optional[int] = None, id_maestro: Optional[int] = None):
+    # `usuario` viene de una cookie: lo recortamos al tamaño de la columna
+    evento = (datetime.now(), (usuario or "")[:100], tipo[:30], descripcion[:2000], id_alumno, id_maestro)
+    with candado_eventos:
+        cola_eventos.append(evento)
+        recortar_cola_eventos()
+
+# HELPER: Si el lote falla, se intenta evento por evento; los que tienen
+# datos inválidos se descartan para que no bloqueen a los demás
+def guardar_eventos_uno_por_uno(lote):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for i, evento in enumerate(lote):
+            try:
+                cursor.execute(SQL_INSERTAR_EVENTO, evento)
+                conn.commit()
+            except (DataError, IntegrityError) as e:
+                conn.rollback()
+                print(f"Error: evento descartado de la bitácora ({e}): {evento}")
+            except Exception:
+                return lote[i:] # Falla de conexión o de tabla: se reintenta después
+        return []
+    finally:
+        conn.close()
+
+# TAREA: Guardar en un solo lote todos los eventos acumulados
+def vaciar_cola_eventos():
+    with candado_eventos:
+        if not cola_eventos: return
+        lote = cola_eventos[:]
+        cola_eventos.clear()
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(SQL_INSERTAR_EVENTO, lote)
+            conn.commit()
+            return
+        except (DataError, IntegrityError):
+            conn.rollback()
+        finally:
+            conn.close()
+        pendientes = guardar_eventos_uno_por_uno(lote)
+    except Exception as e:
+        print(f"Error guardando bitácora de eventos: {e}")
+        pendientes = lote
+
+    if pendientes:
+        # Devolvemos lo pendiente al inicio de la cola para reintentar en orden
+        with candado_eventos:
+            cola_eventos[:0] = pendientes
+            recortar_cola_eventos()
+
+def crear_tabla_eventos():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(SQL_TABLA_EVENTOS)
+    conn.commit()
+    conn.close()
+
+@app.on_event("startup")
+async def iniciar_bitacora_eventos():
+    try:
+        await run_in_threadpool(crear_tabla_eventos)
+    except Exception as e:
+        print(f"Error creando bitácora de eventos: {e}")
+    asyncio.create_task(ciclo_periodico(vaciar_cola_eventos, INTERVALO_GUARDADO_EVENTOS))
+
+@app.on_event("shutdown")
+async def detener_bitacora_eventos():
+    await run_in_threadpool(vaciar_cola_eventos)
+
+# ==========================================
+# 16. REPOSITORIO DOCENTE (PLANEACIONES POR MAESTRO)
+# ==========================================
+# El historial se pagina por "llave" (fecha_subida, id_planeacion) en vez de
+# OFFSET: cada página continúa donde terminó la anterior usando el índice,
+# así que la página 50 cuesta lo mismo que la primera.
+
+# Índice que cubre el filtro por maestro y el orden del historial
+SQL_INDICE_PLANEACIONES = "CREATE INDEX idx_planeaciones_maestro_fecha ON planeaciones (id_maestro, fecha_subida, id_planeacion)"
+
+def crear_indice_planeaciones():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_INDICE_PLANEACIONES)
+    except mysql.connector.Error as e:
+        if e.errno != 1061: # 1061 = el índice ya existe
+            raise
+    finally:
+        conn.close()
+
+@app.on_event("startup")
+async def iniciar_repositorio_docente():
+    try:
+        await run_in_threadpool(crear_indice_planeaciones)
+    except Exception as e:
+        print(f"Error creando índice de planeaciones: {e}")
+
+# VISTA: Directorio de maestros con sus entregas (una sola consulta agrupada)
+@app.get("/director/maestros", response_class=HTMLResponse)
+async def lista_maestros(request: Request):
+    usuario = request.cookies.get("usuario_logueado")
+    if not usuario: return RedirectResponse(url="/")
+
+    ciclo_visualizar = obtener_ciclo_activo(request)
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    query = """
+    SELECT u.id_usuario, u.nombre_completo,
+           COUNT(p.id_planeacion) AS total_archivos,
+           COALESCE(SUM(p.ciclo_escolar = %s), 0) AS del_ciclo,
+           COALESCE(SUM(p.ciclo_escolar = %s AND p.estado = 'APROBADO'), 0) AS aprobadas_ciclo,
+           MAX(p.fecha_subida) AS ultima_entrega
+    FROM users u LEFT JOIN planeaciones p ON p.id_maestro = u.id_usuario
+    WHERE u.rol = 'MAESTRO'
+    GROUP BY u.id_usuario, u.nombre_completo
+    ORDER BY u.nombre_completo
+    """
+    cursor.execute(query, (ciclo_visualizar, ciclo_visualizar))
+    maestros = cursor.fetchall()
+    conn.close()
+
+    return templates.TemplateResponse("director_lista_maestros.html", {
+        "request": request, "lista_maestros": maestros, "ciclo_actual": ciclo_visualizar
+    })
+
+# VISTA: Historial de planeaciones de un maestro (paginado por llave)
+@app.get("/director/ver-planeaciones/{id_maestro}", response_class=HTMLResponse)
+async def ver_planeaciones_maestro(
+    request: Request,
+    id_maestro: int,
+    ciclo: str = "",
+    periodo: str = "",
+    estado: str = "",
+    antes_fecha: str = None,  # Llave de la última fila de la página anterior
+    antes_id: int = None
+):
+    usuario = request.cookies.get("usuario_logueado")
+    if not usuario: return RedirectResponse(url="/")
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT nombre_completo FROM users WHERE id_usuario = %s", (id_maestro,))
+    maestro = cursor.fetchone()
+    if not maestro:
+        conn.close()
+        return RedirectResponse(url="/director/maestros", status_code=303)
+
+    condiciones = ["id_maestro = %s"]
+    parametros = [id_maestro]
+    if ciclo:
+        condiciones.append("ciclo_escolar = %s")
+        parametros.append(ciclo)
+    if periodo:
+        condiciones.append("periodo = %s")
+        parametros.append(periodo)
+    if estado:
+        condiciones.append("estado = %s")
+        parametros.append(estado)
+    if antes_fecha and antes_id:
+        condiciones.append("(fecha_subida < %s OR (fecha_subida = %s AND id_planeacion < %s))")
+        parametros += [antes_fecha, antes_fecha, antes_id]
+
+    # Pedimos una fila de más para saber si hay página siguiente
+    query = f"""
+    SELECT id_planeacion, nombre_archivo, ruta_archivo, comentarios, ciclo_escolar, periodo, estado, fecha_subida
+    FROM planeaciones
+    WHERE {" AND ".join(condiciones)}
+    ORDER BY fecha_subida DESC, id_planeacion DESC
+    LIMIT %s
+    """
+    cursor.execute(query, (*parametros, PLANEACIONES_POR_PAGINA + 1))
+    planeaciones = cursor.fetchall()
+
+    cursor.execute("SELECT nombre FROM ciclos ORDER BY nombre DESC")
+    ciclos = [fila['nombre'] for fila in cursor.fetchall()]
+    conn.close()
+
+    siguiente = None
+    if len(planeaciones) > PLANEACIONES_POR_PAGINA:
+        planeaciones = planeaciones[:PLANEACIONES_POR_PAGINA]
+        ultima = planeaciones[-1]
+        siguiente = urlencode({"ciclo": ciclo, "periodo": periodo, "estado": estado,
+                               "antes_fecha": str(ultima['fecha_subida']), "antes_id": ultima['id_planeacion']})
+
+    return templates.TemplateResponse("director_detalle_planeaciones.html", {
+        "request": request, "id_maestro": id_maestro, "nombre_maestro": maestro['nombre_completo'],
+        "planeaciones": planeaciones, "siguiente": siguiente, "es_primera_pagina": not antes_id,
+        "filtros": {"ciclo": ciclo, "periodo": periodo, "estado": estado},
+        "lista_ciclos": ciclos, "periodos_lista": PERIODOS_LISTA, "estados_lista": ESTADOS_PLANEACION
+    })